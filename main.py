@@ -1,33 +1,123 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 from bson import ObjectId
-from datetime import datetime, timezone
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from datetime import datetime, timedelta, timezone
 
 from database import db, create_document, get_documents
 from schemas import Project, Chapter, CreateProjectRequest, EditChapterRequest, GenerateChapterRequest
 
-app = FastAPI(title="ChapterSmith AI – Complete Story Builder")
+logger = logging.getLogger(__name__)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = FastAPI(title="ChapterSmith AI – Complete Story Builder", default_response_class=ORJSONResponse)
+
+# Comma-separated frontend origins. Set CORS_ORIGINS to an empty string when a gateway
+# in front of the app already handles CORS, and the middleware is skipped entirely.
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
+
+if ALLOWED_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=ALLOWED_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PATCH", "DELETE"],
+        allow_headers=["Content-Type", "Authorization", "If-None-Match"],
+        expose_headers=["ETag"],
+    )
+
+# Chapter generation is pure-Python CPU work, so bulk runs go to worker processes to sidestep the GIL.
+# Created per server worker at startup and sized so all workers together use about one process per core.
+generation_pool: Optional[ProcessPoolExecutor] = None
+
+
+def generation_pool_size() -> int:
+    configured = os.getenv("GENERATION_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    web_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+@app.on_event("startup")
+def start_generation_pool():
+    global generation_pool
+    generation_pool = ProcessPoolExecutor(max_workers=generation_pool_size())
+
+
+@app.on_event("shutdown")
+def shutdown_generation_pool():
+    if generation_pool is not None:
+        generation_pool.shutdown(wait=False, cancel_futures=True)
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    # Chapters are keyed by (project_id, number); no-op if already present
+    if db is None:
+        return
+    try:
+        await db["chapter"].create_index([("project_id", 1), ("number", 1)], unique=True)
+    except Exception:
+        # Keep booting without the database; /test reports the connection state
+        logger.exception("Creating indexes failed")
+        return
+    # Only once the unique index exists, so migrated chapters cannot be duplicated
+    await migrate_embedded_chapters()
+
+
+async def migrate_embedded_chapters():
+    """
+    Move chapters still embedded in project documents into the chapter collection.
+    Idempotent: existing chapter documents win ($setOnInsert), and the embedded array is
+    only unset once its chapters are stored, so an interrupted run simply resumes.
+    """
+    try:
+        cursor = db["project"].find({"chapters": {"$exists": True}}, {"chapters": 1})
+        async for doc in cursor:
+            ops = [
+                UpdateOne(
+                    {"project_id": doc["_id"], "number": ch["number"]},
+                    {"$setOnInsert": {**ch, "project_id": doc["_id"]}},
+                    upsert=True,
+                )
+                for ch in doc.get("chapters") or []
+                if ch.get("number") is not None
+            ]
+            if ops:
+                await db["chapter"].bulk_write(ops, ordered=False)
+            await db["project"].update_one({"_id": doc["_id"]}, {"$unset": {"chapters": ""}})
+    except Exception:
+        # Leave the rest for the next start rather than refusing to boot
+        logger.exception("Migrating embedded chapters failed")
 
 
 # --------------------- Utilities ---------------------
 
+@functools.lru_cache(maxsize=None)
 def collection(name: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     return db[name]
 
 
+def valid_oid(project_id: str) -> ObjectId:
+    """Route dependency that parses the project_id path parameter."""
+    try:
+        return ObjectId(project_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid project id")
+
+
 def serialize_id(doc):
     if not doc:
         return doc
@@ -35,6 +125,55 @@ def serialize_id(doc):
     return doc
 
 
+# Fields needed to (re)generate chapters. Stored projects were validated by Project on
+# create, so generation reads these straight off the document.
+GENERATION_PROJECTION = {"outline": 1, "chapter_count": 1, "pov_mode": 1, "genre": 1}
+
+# Chapter documents as returned to clients, without the storage keys
+CHAPTER_PROJECTION = {"_id": 0, "project_id": 0}
+
+
+async def attach_chapters(docs: List[dict]) -> List[dict]:
+    """Fill each project doc's chapters list from the chapter collection with a single query."""
+    by_project = {}
+    for doc in docs:
+        doc["chapters"] = []
+        by_project[doc["_id"]] = doc
+    if not by_project:
+        return docs
+    cursor = collection("chapter").find({"project_id": {"$in": list(by_project)}}, {"_id": 0}).sort("number", 1)
+    async for chapter in cursor:
+        by_project[chapter.pop("project_id")]["chapters"].append(chapter)
+    return docs
+
+
+def chapter_etag(chapter: dict) -> Optional[str]:
+    """Weak ETag for a stored chapter, derived from its updated_at (ms precision, as Mongo stores it)."""
+    updated_at = chapter.get("updated_at")
+    if updated_at is None:
+        return None
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return f'W/"{int(updated_at.timestamp() * 1000)}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check using weak comparison (RFC 9110): W/ prefixes are ignored and * matches."""
+    opaque = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+async def raise_chapter_lookup_error(oid: ObjectId):
+    """Raise the 404 matching why a chapter query found nothing."""
+    if not await collection("project").find_one({"_id": oid}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Project not found")
+    raise HTTPException(status_code=404, detail="Chapter not found")
+
+
 def resolve_chapter_pov(pov_mode: str, chapter_number: int) -> str:
     if pov_mode == "female":
         return "female"
@@ -44,27 +183,72 @@ def resolve_chapter_pov(pov_mode: str, chapter_number: int) -> str:
     return "female" if chapter_number % 2 == 1 else "male"
 
 
-def compute_word_count(text: str) -> int:
-    return len([w for w in text.split() if w.strip()])
+# Fixed generator text, built and split once at import instead of on every chapter
+
+_FILLER_WORDS = tuple((
+    " I took my time and described what happened in a clear way. I kept the focus on"
+    " real details, steady thoughts, and simple actions. I stayed in first person and"
+    " let each moment breathe without sounding poetic or dramatic."
+).split())
+_FILLER_WC = len(_FILLER_WORDS)
+
+_GENRE_NOTES = {
+    "billionaire": " There is a quiet tension between wealth and loneliness. Power shows up in small practical ways.",
+    "werewolf": " Instinct and duty pull at me. I notice heat, breath, and the press of the crowd without exaggeration.",
+    "mafia": " Danger is present but not sensational. Trust is fragile and every choice has a cost.",
+}
+
+_HEADER_TEMPLATE = (
+    "This chapter follows the outline and continues the story in a clear, human voice. "
+    "I speak in first person as the {pov} lead. The tone is natural and steady. "
+    "The setting and actions are grounded in small details."
+)
+_HEADERS = {pov: _HEADER_TEMPLATE.format(pov=pov) for pov in ("female", "male")}
+
+_DEFAULT_OUTLINE_PARTS = ("The story setup is simple. I meet the other lead and a problem starts.",)
+
+_SCENE_LINES = (
+    "I watch faces and hands. I listen for tone. I keep my feelings steady and honest.",
+    "I let the moment slow enough to understand it, then I make a choice that moves the scene forward.",
+    "Dialogue feels natural. I speak in clear sentences. I avoid dramatic fragments and fancy images.",
+    # Small personal reactions
+    "My body tells a simple truth: my breath changes, my shoulders tense, my hands warm or cool.",
+)
+
+_CLOSING_LINES = (
+    "I stay consistent with point of view. I keep it personal and close. I do not summarize the story.",
+    "When I think of the other lead, I admit what I want and what I fear, even if I do not say it out loud.",
+    "The chapter closes on a clean beat. I do not end with a slogan. I end with a small decision or a question that matters.",
+)
+
+_STEP_TAIL_WORDS = tuple((
+    "I ask a direct question, I listen,"
+    " and I notice how my chest feels and how my thoughts settle. I choose clear words and I keep the pace even."
+    " I avoid clichés. I use plain language. I stay with the present scene and I let the next moment lead me."
+).split())
 
 
-def enforce_word_range(text: str) -> str:
+def _fast_word_count(text: str) -> int:
+    """
+    Word count for text built by " ".join(words). User-provided text is counted by
+    splitting it instead (see edit_chapter).
+    """
+    return text.count(" ") + 1 if text else 0
+
+
+def enforce_word_range_words(words: List[str]) -> List[str]:
     """
     Ensure 1400-1800 words by padding with grounded reflective sentences if short,
     and trimming extra words if long (without breaking sentences harshly).
+    Takes and returns split words so callers can count them with len() instead of
+    re-splitting. The list may be extended in place.
     """
     target_min, target_max = 1400, 1800
-    words = text.split()
     n = len(words)
     if n < target_min:
-        filler = (
-            " I took my time and described what happened in a clear way. I kept the focus on"
-            " real details, steady thoughts, and simple actions. I stayed in first person and"
-            " let each moment breathe without sounding poetic or dramatic."
-        )
         while n < target_min:
-            words.extend(filler.split())
-            n = len(words)
+            words.extend(_FILLER_WORDS)
+            n += _FILLER_WC
     elif n > target_max:
         # Trim to nearest sentence end before max
         trimmed = " ".join(words[:target_max])
@@ -72,45 +256,33 @@ def enforce_word_range(text: str) -> str:
         last_dot = trimmed.rfind(".")
         if last_dot != -1 and last_dot > target_max - 200:
             trimmed = trimmed[: last_dot + 1]
-        return trimmed
-    return " ".join(words[:target_max])
+        return trimmed.split()
+    return words[:target_max]
 
 
 # Simple grounded generator (placeholder, non-explicit)
 
-def grounded_chapter_generator(outline: str, chapter_idx: int, chapter_total: int, pov: str, genre: str) -> str:
+@functools.lru_cache(maxsize=64)
+def _parse_outline(outline: str) -> Tuple[str, ...]:
+    """Split the outline into stripped, non-empty segments used to structure each chapter."""
+    parts = tuple(p.strip("- •\n ") for p in outline.splitlines() if p.strip())
+    return parts or _DEFAULT_OUTLINE_PARTS
+
+
+@functools.lru_cache(maxsize=256)
+def grounded_chapter_generator(
+    parts: Tuple[str, ...], chapter_idx: int, chapter_total: int, pov: str, genre_note: str
+) -> str:
     """
-    Create a long, grounded first-person chapter using the outline as guidance.
-    This generator avoids metaphors, purple prose, and explicit content.
+    Create a long, grounded first-person chapter using the parsed outline (see _parse_outline)
+    as guidance. This generator avoids metaphors, purple prose, and explicit content.
+    Deterministic in its inputs, so results are memoized. The text is single-space
+    joined, which lets callers count it with _fast_word_count.
     """
     lines: List[str] = []
-    header = (
-        f"This chapter follows the outline and continues the story in a clear, human voice. "
-        f"I speak in first person as the {pov} lead. The tone is natural and steady. "
-        f"The setting and actions are grounded in small details."
-    )
+    header = _HEADERS.get(pov) or _HEADER_TEMPLATE.format(pov=pov)
     lines.append(header)
 
-    # Split outline into segments for structure
-    parts = [p.strip("- •\n ") for p in outline.splitlines() if p.strip()]
-    if not parts:
-        parts = ["The story setup is simple. I meet the other lead and a problem starts."]
-
-    # Genre nudges
-    genre_note = ""
-    if genre == "billionaire":
-        genre_note = (
-            " There is a quiet tension between wealth and loneliness. Power shows up in small practical ways."
-        )
-    elif genre == "werewolf":
-        genre_note = (
-            " Instinct and duty pull at me. I notice heat, breath, and the press of the crowd without exaggeration."
-        )
-    elif genre == "mafia":
-        genre_note = (
-            " Danger is present but not sensational. Trust is fragile and every choice has a cost."
-        )
-
     intro = (
         f"It is chapter {chapter_idx} of {chapter_total}. I keep the pacing even and I move from one scene to the next"
         f" without jumps. I react in real time with simple thoughts and clean sentences.{genre_note}"
@@ -122,49 +294,133 @@ def grounded_chapter_generator(outline: str, chapter_idx: int, chapter_total: in
         lines.append(
             f"Scene {i+1}: {p}. I look for what matters right now. I describe only what I would notice."
         )
-        lines.append(
-            "I watch faces and hands. I listen for tone. I keep my feelings steady and honest."
-        )
-        lines.append(
-            "I let the moment slow enough to understand it, then I make a choice that moves the scene forward."
-        )
-        lines.append(
-            "Dialogue feels natural. I speak in clear sentences. I avoid dramatic fragments and fancy images."
-        )
-        # Small personal reactions
-        lines.append(
-            "My body tells a simple truth: my breath changes, my shoulders tense, my hands warm or cool."
-        )
+        lines.extend(_SCENE_LINES)
 
     # Chapter movement and hook
-    lines.append(
-        "I stay consistent with point of view. I keep it personal and close. I do not summarize the story."
-    )
-    lines.append(
-        "When I think of the other lead, I admit what I want and what I fear, even if I do not say it out loud."
-    )
-    lines.append(
-        "The chapter closes on a clean beat. I do not end with a slogan. I end with a small decision or a question that matters."
-    )
+    lines.extend(_CLOSING_LINES)
 
     # Expand body to reach target by elaborating practical steps
-    base = " ".join(lines)
-    # Add rolling elaboration paragraphs tied to outline
+    words = " ".join(lines).split()
+    # Add rolling elaboration paragraphs tied to outline, split once per outline part
     cycle = parts if parts else ["progress"]
+    step_words = [
+        f"I take one more careful step in this situation: {step}.".split() + list(_STEP_TAIL_WORDS)
+        for step in cycle
+    ]
     idx = 0
-    while compute_word_count(base) < 1450:
-        step = cycle[idx % len(cycle)]
+    while len(words) < 1450:
+        words.extend(step_words[idx % len(step_words)])
         idx += 1
-        base += (
-            f" I take one more careful step in this situation: {step}. I ask a direct question, I listen,"
-            f" and I notice how my chest feels and how my thoughts settle. I choose clear words and I keep the pace even."
-        )
-        base += (
-            " I avoid clichés. I use plain language. I stay with the present scene and I let the next moment lead me."
-        )
 
     # Ensure range
-    return enforce_word_range(base)
+    return " ".join(enforce_word_range_words(words))
+
+
+def build_chapter(
+    parts: Tuple[str, ...],
+    ch_num: int,
+    chapter_total: int,
+    pov: str,
+    genre_note: str,
+    user_instructions: Optional[str] = None,
+) -> Chapter:
+    """
+    Generate and validate a single chapter. CPU-bound, so routes run it off the event loop.
+    """
+    text = grounded_chapter_generator(parts, ch_num, chapter_total, pov, genre_note)
+    wc = _fast_word_count(text)
+
+    # Apply user instructions lightly by appending a small targeted adjustment (kept grounded)
+    if user_instructions:
+        words = text.split()
+        words.extend((
+            f"Adjustment note applied: {user_instructions.strip()} I keep the same plot and tone while refining moments."
+        ).split())
+        words = enforce_word_range_words(words)
+        text = " ".join(words)
+        wc = len(words)
+
+    title = f"Chapter {ch_num}"
+    return Chapter(number=ch_num, title=title, text=text, word_count=wc, pov=pov)
+
+
+# Concurrent single-chapter generations for the same project are coalesced: the first
+# request is handled straight away, and any that arrive while it runs are drained
+# together (up to CHAPTER_BATCH_MAX) and persisted with one bulk_write.
+
+CHAPTER_BATCH_MAX = 6
+
+_chapter_queues: Dict[ObjectId, asyncio.Queue] = defaultdict(asyncio.Queue)
+_chapter_drainers: Dict[ObjectId, asyncio.Task] = {}
+
+
+async def submit_chapter_generation(oid: ObjectId, build_args: tuple) -> dict:
+    """Queue a build_chapter(*build_args) job for the project and wait for the stored chapter dict."""
+    future = asyncio.get_running_loop().create_future()
+    _chapter_queues[oid].put_nowait((build_args, future))
+    if oid not in _chapter_drainers:
+        _chapter_drainers[oid] = asyncio.create_task(_drain_chapter_queue(oid))
+    return await future
+
+
+async def _drain_chapter_queue(oid: ObjectId):
+    queue = _chapter_queues[oid]
+    try:
+        while not queue.empty():
+            batch = []
+            while not queue.empty() and len(batch) < CHAPTER_BATCH_MAX:
+                batch.append(queue.get_nowait())
+            try:
+                await _process_chapter_batch(oid, batch)
+            except Exception as e:
+                # Never leave a request waiting on a batch that blew up
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    finally:
+        del _chapter_drainers[oid]
+        _chapter_queues.pop(oid, None)
+
+
+async def _process_chapter_batch(oid: ObjectId, batch: List[tuple]):
+    results = await asyncio.gather(
+        *[asyncio.to_thread(build_chapter, *build_args) for build_args, _ in batch],
+        return_exceptions=True,
+    )
+
+    # Later jobs for the same chapter number supersede earlier ones in the batch, so only
+    # the last is written and every caller for that number gets the stored chapter back.
+    latest: Dict[int, dict] = {}
+    waiters: List[tuple] = []
+    now = datetime.now(timezone.utc)
+    for (_, future), chapter in zip(batch, results):
+        if isinstance(chapter, BaseException):
+            if not future.done():
+                future.set_exception(chapter)
+            continue
+        ch_dict = chapter.model_dump()
+        ch_dict["created_at"] = ch_dict["updated_at"] = now
+        latest[chapter.number] = ch_dict
+        waiters.append((future, chapter.number))
+
+    if not latest:
+        return
+    # Upsert logic for each chapter number
+    ops = [
+        UpdateOne({"project_id": oid, "number": number}, {"$set": {**ch_dict, "project_id": oid}}, upsert=True)
+        for number, ch_dict in latest.items()
+    ]
+    try:
+        await collection("chapter").bulk_write(ops, ordered=False)
+        await collection("project").update_one({"_id": oid}, {"$set": {"updated_at": now}})
+    except Exception as e:
+        for future, _ in waiters:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for future, number in waiters:
+        if not future.done():
+            future.set_result(latest[number])
 
 
 # --------------------- Routes ---------------------
@@ -175,7 +431,7 @@ def read_root():
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -188,7 +444,7 @@ def test_database():
         if db is not None:
             response["database"] = "✅ Available"
             response["connection_status"] = "Connected"
-            response["collections"] = db.list_collection_names()
+            response["collections"] = await db.list_collection_names()
         else:
             response["database"] = "❌ Not Available"
     except Exception as e:
@@ -198,7 +454,7 @@ def test_database():
 
 # Projects CRUD
 @app.post("/api/projects")
-def create_project(req: CreateProjectRequest):
+async def create_project(req: CreateProjectRequest):
     now = datetime.now(timezone.utc)
     project = Project(
         name=req.name,
@@ -207,170 +463,212 @@ def create_project(req: CreateProjectRequest):
         pov_mode=req.pov_mode,
         genre=req.genre,
         rules=req.rules,
-        chapters=[],
         created_at=now,
         updated_at=now,
     )
-    pid = create_document("project", project)
+    # Chapters live in their own collection
+    pid = await create_document("project", project.model_dump(exclude={"chapters"}))
     return {"id": pid}
 
 
 @app.get("/api/projects")
-def list_projects():
-    items = get_documents("project")
+async def list_projects():
+    items = await attach_chapters(await get_documents("project"))
     return [serialize_id(i) for i in items]
 
 
 @app.get("/api/projects/{project_id}")
-def get_project(project_id: str):
-    try:
-        doc = collection("project").find_one({"_id": ObjectId(project_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid project id")
+async def get_project(oid: ObjectId = Depends(valid_oid)):
+    doc = await collection("project").find_one({"_id": oid})
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
+    cursor = collection("chapter").find({"project_id": oid}, CHAPTER_PROJECTION).sort("number", 1)
+    doc["chapters"] = await cursor.to_list(length=None)
     return serialize_id(doc)
 
 
 @app.delete("/api/projects/{project_id}")
-def delete_project(project_id: str):
-    try:
-        res = collection("project").delete_one({"_id": ObjectId(project_id)})
-        return {"deleted": res.deleted_count == 1}
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid project id")
+async def delete_project(oid: ObjectId = Depends(valid_oid)):
+    res = await collection("project").delete_one({"_id": oid})
+    await collection("chapter").delete_many({"project_id": oid})
+    return {"deleted": res.deleted_count == 1}
 
 
 # Generate or regenerate a chapter
 @app.post("/api/projects/{project_id}/chapters/generate")
-def generate_chapter(project_id: str, req: GenerateChapterRequest):
-    try:
-        doc = collection("project").find_one({"_id": ObjectId(project_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid project id")
+async def generate_chapter(req: GenerateChapterRequest, oid: ObjectId = Depends(valid_oid)):
+    doc = await collection("project").find_one({"_id": oid}, GENERATION_PROJECTION)
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    project = Project(**{k: v for k, v in doc.items() if k != "_id"})
+    chapter_count = doc["chapter_count"]
 
     ch_num = req.chapter_number
-    if ch_num < 1 or ch_num > project.chapter_count:
+    if ch_num < 1 or ch_num > chapter_count:
         raise HTTPException(status_code=400, detail="Chapter number out of range")
 
-    pov = resolve_chapter_pov(project.pov_mode, ch_num)
-    text = grounded_chapter_generator(project.outline, ch_num, project.chapter_count, pov, project.genre or "general")
+    pov = resolve_chapter_pov(doc["pov_mode"], ch_num)
+    ch_dict = await submit_chapter_generation(oid, (
+        _parse_outline(doc["outline"]),
+        ch_num,
+        chapter_count,
+        pov,
+        _GENRE_NOTES.get(doc.get("genre") or "general", ""),
+        req.user_instructions,
+    ))
 
-    # Apply user instructions lightly by appending a small targeted adjustment (kept grounded)
-    if req.user_instructions:
-        text += " " + (
-            f"Adjustment note applied: {req.user_instructions.strip()} I keep the same plot and tone while refining moments."
-        )
-        text = enforce_word_range(text)
+    return {"ok": True, "chapter": ch_dict}
 
-    title = f"Chapter {ch_num}"
-    wc = compute_word_count(text)
-    chapter = Chapter(number=ch_num, title=title, text=text, word_count=wc, pov=pov)
 
-    # Upsert logic for this chapter number
-    chapters = [c for c in (project.chapters or [])]
-    existing_idx = next((i for i, c in enumerate(chapters) if c.get("number") == ch_num or getattr(c, "number", None) == ch_num), None)
+# A generate_all claim older than this is treated as abandoned (worker crash, reload,
+# shutdown) and may be taken over by a new request
+GENERATION_CLAIM_TIMEOUT = timedelta(minutes=10)
 
-    ch_dict = chapter.model_dump()
-    ch_dict["created_at"] = datetime.now(timezone.utc)
-    ch_dict["updated_at"] = datetime.now(timezone.utc)
 
-    if existing_idx is None:
-        chapters.append(ch_dict)
-    else:
-        chapters[existing_idx] = ch_dict
+# Bulk generate all chapters
+@app.post("/api/projects/{project_id}/chapters/generate_all", status_code=202)
+async def generate_all(background: BackgroundTasks, oid: ObjectId = Depends(valid_oid)):
+    doc = await collection("project").find_one({"_id": oid}, GENERATION_PROJECTION)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Project not found")
 
-    collection("project").update_one(
-        {"_id": ObjectId(project_id)},
-        {"$set": {"chapters": chapters, "updated_at": datetime.now(timezone.utc)}},
+    # Claim the job atomically so a second request cannot queue a duplicate run,
+    # unless the existing claim is stale
+    now = datetime.now(timezone.utc)
+    res = await collection("project").update_one(
+        {
+            "_id": oid,
+            "$or": [
+                {"generation_status": {"$nin": ["queued", "running"]}},
+                {"generation_started_at": {"$exists": False}},
+                {"generation_started_at": {"$lt": now - GENERATION_CLAIM_TIMEOUT}},
+            ],
+        },
+        {"$set": {"generation_status": "queued", "generation_started_at": now, "updated_at": now}},
     )
+    if res.matched_count == 0:
+        if not await collection("project").find_one({"_id": oid}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Project not found")
+        raise HTTPException(status_code=409, detail="Chapter generation already in progress")
+    background.add_task(run_generate_all, oid, doc, now)
 
-    return {"ok": True, "chapter": ch_dict}
+    return {"ok": True, "job_id": str(oid), "status": "queued"}
 
 
-# Bulk generate all chapters
-@app.post("/api/projects/{project_id}/chapters/generate_all")
-def generate_all(project_id: str):
-    try:
-        doc = collection("project").find_one({"_id": ObjectId(project_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid project id")
+@app.get("/api/projects/{project_id}/chapters/generate_all/status")
+async def generate_all_status(oid: ObjectId = Depends(valid_oid)):
+    doc = await collection("project").find_one({"_id": oid}, {"generation_status": 1})
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
+    return {"job_id": str(oid), "status": doc.get("generation_status") or "idle"}
 
-    project = Project(**{k: v for k, v in doc.items() if k != "_id"})
-
-    chapters: List[dict] = []
-    for ch_num in range(1, project.chapter_count + 1):
-        pov = resolve_chapter_pov(project.pov_mode, ch_num)
-        text = grounded_chapter_generator(project.outline, ch_num, project.chapter_count, pov, project.genre or "general")
-        title = f"Chapter {ch_num}"
-        wc = compute_word_count(text)
-        ch_dict = Chapter(number=ch_num, title=title, text=text, word_count=wc, pov=pov).model_dump()
-        ch_dict["created_at"] = datetime.now(timezone.utc)
-        ch_dict["updated_at"] = datetime.now(timezone.utc)
-        chapters.append(ch_dict)
-
-    collection("project").update_one(
-        {"_id": ObjectId(project_id)},
-        {"$set": {"chapters": chapters, "updated_at": datetime.now(timezone.utc)}},
-    )
 
-    return {"ok": True, "count": len(chapters)}
+async def run_generate_all(oid: ObjectId, doc: dict, claimed_at: datetime):
+    """
+    Background job for generate_all: builds every chapter and records progress in the
+    project's generation_status field (queued -> running -> done / failed).
+    Status writes are scoped to this job's claim, so a job whose stale claim was taken
+    over cannot overwrite the status of the newer run.
+    """
+    claim = {"_id": oid, "generation_started_at": claimed_at}
+    try:
+        await collection("project").update_one(claim, {"$set": {"generation_status": "running"}})
+        await _generate_all_chapters(claim, doc)
+    except BaseException:
+        # Also covers cancellation on shutdown, which would otherwise leave "running" behind
+        await collection("project").update_one(claim, {"$set": {"generation_status": "failed"}})
+        raise
+
+
+async def _generate_all_chapters(claim: dict, doc: dict):
+    oid = claim["_id"]
+    # Parse the shared inputs once rather than in every chapter job
+    parts = _parse_outline(doc["outline"])
+    genre_note = _GENRE_NOTES.get(doc.get("genre") or "general", "")
+    chapter_count = doc["chapter_count"]
+    pov_mode = doc["pov_mode"]
+
+    ops: List[UpdateOne] = []
+    loop = asyncio.get_running_loop()
+    built = await asyncio.gather(*[
+        loop.run_in_executor(
+            generation_pool,
+            build_chapter,
+            parts,
+            ch_num,
+            chapter_count,
+            resolve_chapter_pov(pov_mode, ch_num),
+            genre_note,
+        )
+        for ch_num in range(1, chapter_count + 1)
+    ])
+    now = datetime.now(timezone.utc)
+    for chapter in built:
+        ch_dict = chapter.model_dump()
+        ch_dict["created_at"] = ch_dict["updated_at"] = now
+        ch_dict["project_id"] = oid
+        ops.append(UpdateOne({"project_id": oid, "number": chapter.number}, {"$set": ch_dict}, upsert=True))
+
+    await collection("chapter").bulk_write(ops, ordered=False)
+    await collection("project").update_one(
+        claim,
+        {"$set": {"generation_status": "done", "updated_at": now}},
+    )
 
 
 # Edit a chapter
 @app.patch("/api/projects/{project_id}/chapters/{chapter_number}")
-def edit_chapter(project_id: str, chapter_number: int, body: EditChapterRequest):
-    try:
-        doc = collection("project").find_one({"_id": ObjectId(project_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid project id")
-    if not doc:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    chapters = doc.get("chapters", [])
-    idx = next((i for i, c in enumerate(chapters) if c.get("number") == chapter_number), None)
-    if idx is None:
-        raise HTTPException(status_code=404, detail="Chapter not found")
-
+async def edit_chapter(chapter_number: int, body: EditChapterRequest, oid: ObjectId = Depends(valid_oid)):
+    updates = {}
     if body.title is not None:
-        chapters[idx]["title"] = body.title
+        updates["title"] = body.title
     if body.text is not None:
-        chapters[idx]["text"] = enforce_word_range(body.text)
-        chapters[idx]["word_count"] = compute_word_count(chapters[idx]["text"])
-    chapters[idx]["updated_at"] = datetime.now(timezone.utc)
+        words = enforce_word_range_words(body.text.split())
+        updates["text"] = " ".join(words)
+        updates["word_count"] = len(words)
+    now = datetime.now(timezone.utc)
+    updates["updated_at"] = now
 
-    collection("project").update_one(
-        {"_id": ObjectId(project_id)},
-        {"$set": {"chapters": chapters, "updated_at": datetime.now(timezone.utc)}},
+    chapter = await collection("chapter").find_one_and_update(
+        {"project_id": oid, "number": chapter_number},
+        {"$set": updates},
+        projection=CHAPTER_PROJECTION,
+        return_document=ReturnDocument.AFTER,
     )
+    if not chapter:
+        await raise_chapter_lookup_error(oid)
+    await collection("project").update_one({"_id": oid}, {"$set": {"updated_at": now}})
 
-    return {"ok": True, "chapter": chapters[idx]}
+    return {"ok": True, "chapter": chapter}
 
 
 # Copy chapter endpoint (returns just the text)
 @app.get("/api/projects/{project_id}/chapters/{chapter_number}/copy")
-def copy_chapter_text(project_id: str, chapter_number: int):
-    try:
-        doc = collection("project").find_one({"_id": ObjectId(project_id)})
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid project id")
-    if not doc:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    chapter = next((c for c in doc.get("chapters", []) if c.get("number") == chapter_number), None)
+async def copy_chapter_text(request: Request, chapter_number: int, oid: ObjectId = Depends(valid_oid)):
+    chapter = await collection("chapter").find_one({"project_id": oid, "number": chapter_number}, CHAPTER_PROJECTION)
     if not chapter:
-        raise HTTPException(status_code=404, detail="Chapter not found")
-
-    return {"title": chapter.get("title"), "text": chapter.get("text"), "word_count": chapter.get("word_count")}
+        await raise_chapter_lookup_error(oid)
+
+    # Text only changes on edit/regenerate, so let clients revalidate instead of re-downloading it
+    headers = {"Cache-Control": "private, max-age=0, must-revalidate"}
+    etag = chapter_etag(chapter)
+    if etag:
+        headers["ETag"] = etag
+        if etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+
+    # Plain str/int payload, so skip the jsonable_encoder pass and serialize with orjson directly
+    return ORJSONResponse(
+        {"title": chapter.get("title"), "text": chapter.get("text"), "word_count": chapter.get("word_count")},
+        headers=headers,
+    )
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # Exported so each worker sizes its generation pool by its share of the cores
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    # Workers need an import string; each process creates its own Motor client on import
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
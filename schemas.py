@@ -6,7 +6,7 @@ form of the class name (e.g., Project -> "project").
 """
 from typing import List, Optional, Literal
 from pydantic import BaseModel, Field
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 class Chapter(BaseModel):
@@ -15,7 +15,7 @@ class Chapter(BaseModel):
     text: str = Field(..., min_length=1, description="Full chapter text")
     word_count: int = Field(..., ge=0, description="Computed word count for the chapter")
     pov: Literal["female", "male"] = Field("female", description="Resolved POV for this chapter")
-    created_at: Optional[datetime] = None
+    created_at: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: Optional[datetime] = None
 
 
@@ -26,7 +26,15 @@ class Project(BaseModel):
     pov_mode: Literal["female", "male", "dual"] = Field("female", description="POV strategy for the story")
     genre: Optional[Literal["billionaire", "werewolf", "mafia", "general"]] = Field("general", description="Optional genre to bias tone")
     rules: Optional[str] = Field(None, description="Extra writing rules provided by user")
-    chapters: List[Chapter] = Field(default_factory=list, description="Generated chapters")
+    chapters: List[Chapter] = Field(
+        default_factory=list, description="Generated chapters (stored in the chapter collection, keyed by project_id)"
+    )
+    generation_status: Optional[Literal["queued", "running", "done", "failed"]] = Field(
+        None, description="Progress of the latest background generate_all job"
+    )
+    generation_started_at: Optional[datetime] = Field(
+        None, description="When the latest generate_all job was claimed; stale claims can be taken over"
+    )
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
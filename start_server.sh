@@ -15,5 +15,12 @@ mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
+# Multiple workers when WEB_CONCURRENCY is set (uvicorn reads it for --workers);
+# otherwise a single auto-reloading worker for development
+if [ -n "$WEB_CONCURRENCY" ]; then
+  RELOAD=""
+else
+  RELOAD="--reload"
+fi
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools $RELOAD > logs/server.log 2>&1 
 echo "Server started in background"